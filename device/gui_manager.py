@@ -1,21 +1,71 @@
 import tkinter as tk
 from tkinter import messagebox, simpledialog, ttk
-import keyring
+import tkinter.font as tkfont
 import subprocess
+import signal
+import queue
 import sys
 import os
 import threading
 import time
-import pystray
-from PIL import Image, ImageDraw
 import logging
+import logging.handlers
+# pystray, PIL and keyring are imported lazily where first needed: they are
+# only used after specific user actions and dominate cold-start time,
+# especially in frozen builds.
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
 
 SERVICE = 'kasa-alpaca'
-LOG_FILE = os.path.join(os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__), 'kasa_alpaca_gui.log')
+MAX_LOG_LINES = 15
+_EXE_DIR = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__)
+_APP_PATH = os.path.join(_EXE_DIR, 'app.py')
+if sys.platform == 'win32':
+    # Prefer pythonw.exe next to the running interpreter rather than a
+    # string replace on sys.executable, which breaks for python3.x.exe or
+    # differently-cased names.
+    _pythonw = os.path.join(os.path.dirname(sys.executable), 'pythonw.exe')
+    _PYTHON_EXE = _pythonw if os.path.exists(_pythonw) else sys.executable
+    # New process group so CTRL_BREAK_EVENT reaches only the server child
+    _CREATE_FLAGS = (getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+                     | getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0))
+else:
+    _PYTHON_EXE = sys.executable
+    _CREATE_FLAGS = 0
+_TRAY_IMAGE = None
+
+
+def _tray_image():
+    # The icon never changes, so draw it once and reuse it across
+    # minimize/restore cycles.
+    global _TRAY_IMAGE
+    if _TRAY_IMAGE is None:
+        from PIL import Image, ImageDraw
+        image = Image.new('RGB', (64, 64), color='white')
+        d = ImageDraw.Draw(image)
+        d.ellipse((16, 16, 48, 48), fill='blue')
+        _TRAY_IMAGE = image
+    return _TRAY_IMAGE
+LOG_FILE = os.path.join(_EXE_DIR, 'kasa_alpaca_gui.log')
+# Log emission from the Tk thread is just a queue.put; the disk and stream
+# writes happen on the QueueListener's own thread.
+_log_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+_log_file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+_log_file_handler.setFormatter(_log_formatter)
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(_log_formatter)
+_log_record_q = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(
+    _log_record_q, _log_file_handler, _log_stream_handler, respect_handler_level=True
+)
+_log_listener.start()
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s %(levelname)s: %(message)s',
-    handlers=[logging.FileHandler(LOG_FILE, encoding='utf-8'), logging.StreamHandler()]
+    handlers=[logging.handlers.QueueHandler(_log_record_q)]
 )
 
 class KasaManagerApp:
@@ -27,39 +77,78 @@ class KasaManagerApp:
         self.server_process = None
         self.status_var = tk.StringVar()
         self.status_var.set('Server not running.')
-        self.log_lines = []
         self.log_text = None
         self.tray_icon = None
+        self._cred_cache = None
+        self._log_q = queue.Queue(maxsize=1024)
+        # One long-lived worker thread runs all blocking jobs (server
+        # start/stop waits) instead of spawning a fresh thread per action.
+        self._work_q = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
         self._build_ui()
         self.root.protocol('WM_DELETE_WINDOW', self._on_minimize)
-        self._update_status_periodically()
-        self._first_run_check()
+        # Defer the keyring round-trips and any welcome dialog until Tk has
+        # painted the first frame, so the window appears immediately.
+        self.root.after_idle(self._first_run_check)
         self._log_file_last_pos = 0
+        self._log_fd = None
+        self._log_file_exists = os.path.exists(LOG_FILE)
+        self._log_dirty = threading.Event()
+        self._log_observer = None
+        self._log_watch = self._start_log_watcher()
         self._update_log_periodically()
+        self._tick()
 
     def _build_ui(self):
+        # Resolve each font once up front; widgets share the Font objects
+        # instead of Tk re-resolving a (family, size, style) tuple per widget.
+        self._title_font = tkfont.Font(family='Segoe UI', size=16, weight='bold')
+        self._status_font = tkfont.Font(family='Segoe UI', size=10, slant='italic')
+        self._heading_font = tkfont.Font(family='Segoe UI', size=9, weight='bold')
+        self._mono_font = tkfont.Font(family='Consolas', size=9)
         frm = ttk.Frame(self.root, padding=10)
         frm.pack(fill='both', expand=True)
-        ttk.Label(frm, text='Kasa Alpaca Switch Manager', font=('Segoe UI', 16, 'bold')).pack(pady=(0, 10))
+        ttk.Label(frm, text='Kasa Alpaca Switch Manager', font=self._title_font).pack(pady=(0, 10))
         ttk.Button(frm, text='Set/Update Credentials', command=self.set_credentials).pack(fill='x', pady=5)
         ttk.Button(frm, text='Start Server', command=self.start_server).pack(fill='x', pady=5)
         ttk.Button(frm, text='Stop Server', command=self.stop_server).pack(fill='x', pady=5)
-        ttk.Label(frm, textvariable=self.status_var, foreground='blue', font=('Segoe UI', 10, 'italic')).pack(pady=(10, 0))
-        ttk.Label(frm, text='Recent Log:', font=('Segoe UI', 9, 'bold')).pack(anchor='w', pady=(15, 0))
-        self.log_text = tk.Text(frm, height=10, width=45, state='disabled', font=('Consolas', 9))  # taller log area
+        ttk.Label(frm, textvariable=self.status_var, foreground='blue', font=self._status_font).pack(pady=(10, 0))
+        ttk.Label(frm, text='Recent Log:', font=self._heading_font).pack(anchor='w', pady=(15, 0))
+        self.log_text = tk.Text(frm, height=10, width=45, state='disabled', font=self._mono_font)  # taller log area
         self.log_text.pack(pady=(0, 5))
         ttk.Button(frm, text='Copy Server URL', command=self.copy_server_url).pack(fill='x', pady=2)
         ttk.Button(frm, text='Exit', command=self.on_exit).pack(side='bottom', fill='x', pady=5)
         self.progress = ttk.Progressbar(frm, mode='indeterminate')
 
+    def _worker(self):
+        while True:
+            job = self._work_q.get()
+            try:
+                job()
+            except Exception as ex:
+                logging.error(f"Background job failed: {ex}")
+
+    def _submit(self, job):
+        self._work_q.put(job)
+
+    def _get_credentials(self):
+        # Each keyring.get_password is a DPAPI/Secret-Service round-trip, so
+        # fetch the pair once and invalidate only when credentials are saved.
+        if self._cred_cache is None:
+            import keyring
+            email = keyring.get_password(SERVICE, 'email')
+            password = keyring.get_password(SERVICE, 'password')
+            self._cred_cache = (email, password)
+        return self._cred_cache
+
     def _first_run_check(self):
-        email = keyring.get_password(SERVICE, 'email')
-        password = keyring.get_password(SERVICE, 'password')
+        email, password = self._get_credentials()
         if not email or not password:
             messagebox.showinfo('Welcome', 'Welcome! Please set your Kasa credentials to begin.')
             self.set_credentials()
 
     def set_credentials(self):
+        import keyring
         email = simpledialog.askstring('Email', 'Enter Kasa account email:', parent=self.root)
         if not email:
             return
@@ -68,6 +157,7 @@ class KasaManagerApp:
             return
         keyring.set_password(SERVICE, 'email', email)
         keyring.set_password(SERVICE, 'password', password)
+        self._cred_cache = (email, password)
         messagebox.showinfo('Credentials', 'Credentials updated successfully!')
 
     def start_server(self):
@@ -79,27 +169,29 @@ class KasaManagerApp:
         self.progress.start()
         def run():
             try:
-                exe_dir = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__)
-                os.chdir(exe_dir)
-                if getattr(sys, 'frozen', False):
-                    exe_path = sys.executable
-                    # Launch the same exe with --server argument
-                    creationflags = 0
-                    if sys.platform == 'win32':
-                        creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
-                    self.server_process = subprocess.Popen(
-                        [exe_path, '--server'],
-                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
-                        creationflags=creationflags, cwd=exe_dir
-                    )
-                else:
-                    python_exe = sys.executable.replace('python.exe', 'pythonw.exe') if sys.platform == 'win32' else sys.executable
-                    app_path = os.path.join(exe_dir, 'app.py')
-                    self.server_process = subprocess.Popen(
-                        [python_exe, app_path],
-                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
-                        cwd=exe_dir
-                    )
+                # The child gets its working directory via cwd=; never chdir
+                # the whole GUI process, which races with any code resolving
+                # relative paths on other threads.
+                # The server appends straight to the log file the GUI already
+                # tails - no pipes, so the child can log any amount without
+                # ever blocking on a full pipe buffer.
+                with open(LOG_FILE, 'ab') as log_out:
+                    if getattr(sys, 'frozen', False):
+                        # Launch the same exe with --server argument
+                        self.server_process = subprocess.Popen(
+                            [sys.executable, '--server'],
+                            stdout=log_out, stderr=log_out,
+                            creationflags=_CREATE_FLAGS, cwd=_EXE_DIR,
+                            env={**os.environ, 'PYTHONUNBUFFERED': '1'}
+                        )
+                    else:
+                        self.server_process = subprocess.Popen(
+                            [_PYTHON_EXE, _APP_PATH],
+                            stdout=log_out, stderr=log_out,
+                            creationflags=_CREATE_FLAGS, cwd=_EXE_DIR,
+                            env={**os.environ, 'PYTHONUNBUFFERED': '1'}
+                        )
+                self._log_file_exists = True
                 self.status_var.set('Server running.')
             except Exception as ex:
                 logging.error(f"Failed to start server: {ex}")
@@ -107,46 +199,149 @@ class KasaManagerApp:
             finally:
                 self.progress.stop()
                 self.progress.pack_forget()
-        threading.Thread(target=run, daemon=True).start()
+        self._submit(run)
+
+    def _signal_server(self, proc):
+        # Ask the child to exit cleanly first (so it can flush its logs);
+        # callers escalate to kill() if it ignores the signal.
+        try:
+            if sys.platform == 'win32':
+                proc.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                proc.send_signal(signal.SIGTERM)
+        except Exception:
+            proc.terminate()
 
     def stop_server(self):
-        if self.server_process and self.server_process.poll() is None:
-            self.server_process.terminate()
-            try:
-                self.server_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.server_process.kill()
-            self.status_var.set('Server stopped.')
+        proc = self.server_process
+        if proc and proc.poll() is None:
+            # Wait off the Tk thread so the GUI keeps pumping events.
+            self._signal_server(proc)
+            self.status_var.set('Stopping server...')
+
+            def wait_for_exit():
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                try:
+                    self.root.after(0, self.status_var.set, 'Server stopped.')
+                except tk.TclError:
+                    pass  # window already destroyed on exit
+            self._submit(wait_for_exit)
         else:
             self.status_var.set('Server not running.')
 
+    def _put_log_line(self, line):
+        # Bounded queue: under a log flood, shed the oldest line rather than
+        # grow without limit - only the newest MAX_LOG_LINES are visible anyway.
+        try:
+            self._log_q.put_nowait(line)
+        except queue.Full:
+            try:
+                self._log_q.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._log_q.put_nowait(line)
+            except queue.Full:
+                pass
+
+    def _tick(self):
+        # One shared scheduler tick: drain queued log lines and refresh the
+        # status label, skipping the StringVar set when nothing changed.
+        lines = []
+        try:
+            while True:
+                lines.append(self._log_q.get_nowait())
+        except queue.Empty:
+            pass
+        if lines:
+            self._append_log_lines(lines)
+        if self.server_process and self.server_process.poll() is None:
+            desired = 'Server running at http://127.0.0.1:5555'
+            if self.status_var.get() != desired:
+                self.status_var.set(desired)
+        self.root.after(500, self._tick)
+
+    def _start_log_watcher(self):
+        # Event-driven log tailing: only touch the file when the OS says it
+        # changed. Falls back to plain 1 Hz polling if watchdog is missing
+        # or the observer fails to start.
+        if not WATCHDOG_AVAILABLE:
+            return False
+
+        app = self
+
+        class _LogChanged(FileSystemEventHandler):
+            def on_modified(self, event):
+                if event.src_path == LOG_FILE:
+                    app._log_dirty.set()
+
+            on_created = on_modified
+
+        try:
+            self._log_observer = Observer()
+            self._log_observer.daemon = True
+            self._log_observer.schedule(_LogChanged(), os.path.dirname(LOG_FILE))
+            self._log_observer.start()
+            return True
+        except Exception as ex:
+            logging.warning(f"Log file watcher unavailable, polling instead: {ex}")
+            self._log_observer = None
+            return False
+
     def _update_log_periodically(self):
+        if not self._log_watch or self._log_dirty.is_set():
+            self._log_dirty.clear()
+            self._read_log_file()
+        self.root.after(1000, self._update_log_periodically)
+
+    def _read_log_file(self):
+        # Tail the log through one long-lived fd; a cheap fstat() skips the
+        # read entirely when the file hasn't grown since the last tick.
         try:
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                f.seek(self._log_file_last_pos)
-                new_lines = f.readlines()
-                self._log_file_last_pos = f.tell()
-                if new_lines:
-                    for line in new_lines:
-                        self._append_log(line)
+            if not self._log_file_exists:
+                # Don't pay for a failed open() every tick on a fresh install
+                if not os.path.exists(LOG_FILE):
+                    return
+                self._log_file_exists = True
+            if self._log_fd is None:
+                self._log_fd = os.open(LOG_FILE, os.O_RDONLY)
+            st = os.fstat(self._log_fd)
+            if st.st_size < self._log_file_last_pos:
+                # Log was rotated or truncated - reopen and start over
+                os.close(self._log_fd)
+                self._log_fd = os.open(LOG_FILE, os.O_RDONLY)
+                self._log_file_last_pos = 0
+                st = os.fstat(self._log_fd)
+            if st.st_size > self._log_file_last_pos:
+                os.lseek(self._log_fd, self._log_file_last_pos, os.SEEK_SET)
+                # Cap the read so a runaway log can't stall a single tick
+                data = os.read(self._log_fd, min(st.st_size - self._log_file_last_pos, 262144))
+                self._log_file_last_pos += len(data)
+                if self._log_file_last_pos < st.st_size:
+                    # Capped read left bytes behind; re-arm the dirty flag
+                    # so the next tick drains them even if no further
+                    # filesystem event arrives.
+                    self._log_dirty.set()
+                for line in data.decode('utf-8', 'replace').splitlines():
+                    self._put_log_line(line)
         except Exception:
             pass
-        self.root.after(1000, self._update_log_periodically)
 
-    def _append_log(self, line):
-        self.log_lines.append(line.strip())
-        if len(self.log_lines) > 15:
-            self.log_lines = self.log_lines[-15:]
+    def _append_log_lines(self, lines):
+        # Append-only: insert the whole batch in one Tk call, then trim excess
+        # lines from the top. The Text widget itself is the ring buffer - no
+        # second copy of the lines is kept on the Python side.
         self.log_text.config(state='normal')
-        self.log_text.delete(1.0, tk.END)
-        self.log_text.insert(tk.END, '\n'.join(self.log_lines))
+        self.log_text.insert(tk.END, ''.join(line.strip() + '\n' for line in lines))
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - (MAX_LOG_LINES + 1)
+        if excess > 0:
+            self.log_text.delete('1.0', f'{excess + 1}.0')
+        self.log_text.see(tk.END)
         self.log_text.config(state='disabled')
 
-    def _update_status_periodically(self):
-        if self.server_process and self.server_process.poll() is None:
-            self.status_var.set('Server running at http://127.0.0.1:5555')
-        self.root.after(2000, self._update_status_periodically)
-
     def copy_server_url(self):
         self.root.clipboard_clear()
         self.root.clipboard_append('http://127.0.0.1:5555')
@@ -157,34 +352,58 @@ class KasaManagerApp:
         self._show_tray_icon()
 
     def _show_tray_icon(self):
+        # The Icon (and its thread) is created once on first minimize; later
+        # cycles just flip visibility instead of re-registering the shell
+        # icon every time.
         if self.tray_icon:
+            self.tray_icon.visible = True
             return
-        image = Image.new('RGB', (64, 64), color='white')
-        d = ImageDraw.Draw(image)
-        d.ellipse((16, 16, 48, 48), fill='blue')
+        import pystray
         menu = pystray.Menu(
             pystray.MenuItem('Show', self._on_tray_show),
             pystray.MenuItem('Start Server', self.start_server),
             pystray.MenuItem('Stop Server', self.stop_server),
             pystray.MenuItem('Exit', self._on_tray_exit)
         )
-        self.tray_icon = pystray.Icon('KasaSwitch', image, 'Kasa Switch Manager', menu)
+        self.tray_icon = pystray.Icon('KasaSwitch', _tray_image(), 'Kasa Switch Manager', menu)
         threading.Thread(target=self.tray_icon.run, daemon=True).start()
 
     def _on_tray_show(self, icon=None, item=None):
         self.root.deiconify()
         if self.tray_icon:
-            self.tray_icon.stop()
-            self.tray_icon = None
+            self.tray_icon.visible = False
 
     def _on_tray_exit(self, icon=None, item=None):
         self.on_exit()
-        if self.tray_icon:
-            self.tray_icon.stop()
-            self.tray_icon = None
 
     def on_exit(self):
-        self.stop_server()
+        # Stop the server synchronously here: the worker thread is a
+        # daemon and dies with the process, so the async stop_server()
+        # path would orphan a child that ignores the signal. A bounded
+        # wait on exit is fine - the window is closing anyway.
+        proc = self.server_process
+        if proc and proc.poll() is None:
+            self._signal_server(proc)
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self._log_observer is not None:
+            try:
+                self._log_observer.stop()
+            except Exception:
+                pass
+            self._log_observer = None
+        if self._log_fd is not None:
+            try:
+                os.close(self._log_fd)
+            except OSError:
+                pass
+            self._log_fd = None
+        try:
+            _log_listener.stop()
+        except Exception:
+            pass
         self.root.destroy()
         if self.tray_icon:
             self.tray_icon.stop()
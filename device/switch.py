@@ -1,748 +1,885 @@
-# --------------------
-# Imports
-# --------------------
-import asyncio
-import keyring
-from kasa import Discover, SmartPlug
-from datetime import datetime, timezone
-import sys
-import threading
-import time
-import logging
-try:
-    from tzlocal import get_localzone
-    TZLOCAL_AVAILABLE = True
-except ImportError:
-    TZLOCAL_AVAILABLE = False
-from falcon import Request, Response, HTTPBadRequest, before
-from .shr import PropertyResponse, MethodResponse, PreProcessRequest, StateValue, get_request_field, to_bool
-from .exceptions import *
-
-# --------------------
-# Globals and Metadata
-# --------------------
-
-logger: Logger = None
-if logger is None:
-    logger = logging.getLogger("kasa-alpaca")
-    if not logger.hasHandlers():
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s'
-        )
-
-maxdev = 0  # Single instance
-
-class SwitchMetadata:
-    Name = 'Kasa Switch'
-    Version = '1.0.0'
-    Description = 'ASCOM Alpaca driver for Kasa switches'
-    DeviceType = 'Switch'
-    DeviceID = 'b7e1e2c2-7e2a-4b7a-9e2e-123456789abc'  # Replace with your own GUID if desired
-    Info = 'Kasa Switch Alpaca Device\nImplements ISwitch\nASCOM Initiative'
-    MaxDeviceNumber = maxdev
-    InterfaceVersion = 1
-
-# --------------------
-# KasaSwitchController
-# --------------------
-
-class KasaSwitchController:
-    """Manages Kasa switches via python-kasa library."""
-    def __init__(self):
-        self.connected = False
-        self.device_list = []
-        self.device_objs = []
-        self.lock = threading.RLock()
-        self.loop = asyncio.new_event_loop()
-        self._loop_thread = threading.Thread(target=self._run_loop, daemon=True)
-        self._loop_thread.start()
-        self.email = None
-        self.password = None
-        self._load_credentials()
-
-    def _run_loop(self):
-        asyncio.set_event_loop(self.loop)
-        self.loop.run_forever()
-
-    def _load_credentials(self):
-        self.email = keyring.get_password('kasa-alpaca', 'email')
-        self.password = keyring.get_password('kasa-alpaca', 'password')
-        if not self.email or not self.password:
-            self._prompt_and_store_credentials()
-
-    def _prompt_and_store_credentials(self):
-        import getpass
-        email = input('Enter Kasa account email: ')
-        password = getpass.getpass('Password: ')
-        keyring.set_password('kasa-alpaca', 'email', email)
-        keyring.set_password('kasa-alpaca', 'password', password)
-        self.email = email
-        self.password = password
-
-    def update_credentials(self):
-        self._prompt_and_store_credentials()
-
-    def connect(self):
-        import time as _time
-        if logger:
-            logger.info(f"connect() called. Event loop closed? {self.loop.is_closed()}")
-        global maxdev
-        with self.lock:
-            # Ensure the event loop is set as current for this thread
-            if self.loop.is_closed():
-                logger.info("Event loop was closed, creating new event loop.")
-                self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-            logger.info(f"connect() using event loop: {self.loop}")
-            # Add a short delay to allow OS resources to settle after disconnect
-            _time.sleep(0.5)
-            start = time.time()
-            try:
-                fut = asyncio.run_coroutine_threadsafe(self._get_device_list(), self.loop)
-                self.device_list, self.device_objs = fut.result()
-                self.child_map = {}  # Map device_list index to (dev_idx, child_idx)
-                new_device_list = []
-                new_device_objs = []
-                self.readonly_switches = set()  # Track readonly switches (parent devices)
-                self.cloud_switch_map = {}  # Map: index -> parent idx for cloud connection switches
-                for idx, dev in enumerate(self.device_objs):
-                    # Add Power (On Since) as a readonly switch for the parent
-                    new_device_list.append("Power")
-                    new_device_objs.append(dev)
-                    self.readonly_switches.add(len(new_device_list)-1)
-                    parent_idx = len(new_device_list)-1
-                    # Add Cloud Connection as a readonly switch for the parent
-                    new_device_list.append("Cloud Connection")
-                    new_device_objs.append(dev)
-                    self.readonly_switches.add(len(new_device_list)-1)
-                    self.cloud_switch_map[len(new_device_list)-1] = parent_idx
-                    if hasattr(dev, 'children') and dev.children:
-                        for cidx, child in enumerate(dev.children):
-                            name = f"{child.alias}"
-                            new_device_list.append(name)
-                            self.child_map[len(new_device_list)-1] = (idx, cidx)
-                            new_device_objs.append(dev)
-                self.device_list = new_device_list
-                self.device_objs = new_device_objs
-                self.connected = True
-                maxdev = len(self.device_list)
-                SwitchMetadata.MaxDeviceNumber = maxdev
-                elapsed = time.time() - start
-                if logger:
-                    logger.info(f"Device list loaded in {elapsed:.2f}s: {self.device_list}")
-            except Exception as ex:
-                self.connected = False
-                if logger:
-                    logger.error(f"Connect failed after {time.time()-start:.2f}s: {ex}")
-                raise DriverException(0x500, f"python-kasa devicelist failed: {ex}")
-
-    def disconnect(self):
-        import gc
-        with self.lock:
-            logger.info(f"disconnect() called. Event loop running? {self.loop.is_running()} closed? {self.loop.is_closed()}")
-            self.connected = False
-            self.device_list = []
-            self.device_objs = []
-            # Gracefully close asyncio event loop if running
-            try:
-                if self.loop.is_running():
-                    self.loop.call_soon_threadsafe(self.loop.stop)
-                if hasattr(self, '_loop_thread') and self._loop_thread.is_alive():
-                    self._loop_thread.join(timeout=2)
-                if not self.loop.is_closed():
-                    self.loop.close()
-                logger.info("Graceful disconnect: asyncio event loop closed and thread joined.")
-            except Exception as ex:
-                logger.error(f"Graceful disconnect: error closing event loop: {ex}")
-            # Recreate a new event loop for future connections
-            self.loop = asyncio.new_event_loop()
-            # Start the new event loop in a background thread
-            self._loop_thread = threading.Thread(target=self._run_loop, daemon=True)
-            self._loop_thread.start()
-            logger.info(f"disconnect() created new event loop: {self.loop}")
-            # Force garbage collection to clean up sockets/resources
-            gc.collect()
-
-    def is_connected(self):
-        return self.connected
-
-    async def _get_device_list(self):
-        devices = []
-        device_objs = []
-        try:
-            found = await Discover.discover()
-            logger.info(f"Discover.discover() returned: {found}")
-            if not found:
-                logger.warning("No devices discovered.")
-                return devices, device_objs
-            for addr, dev in found.items():
-                try:
-                    await dev.update()
-                    logger.info(f"Device updated: {getattr(dev, 'alias', addr)}")
-                    devices.append(dev.alias)
-                    device_objs.append(dev)
-                except Exception as ex:
-                    logger.error(f"Device update failed for {getattr(dev, 'alias', addr)}: {ex}")
-            if logger:
-                logger.info(f"Discovered devices: {devices}")
-            return devices, device_objs
-        except Exception as ex:
-            logger.error(f"Device discovery failed: {ex}")
-            return devices, device_objs
-
-    def _safe_async(self, coro):
-        """Run an async coroutine safely from sync context using the dedicated event loop."""
-        # Always use run_coroutine_threadsafe for self.loop
-        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
-        return fut.result()
-
-    def get_switch(self, id=0):
-        name = self._resolve_id(id)
-        idx = self.device_list.index(name)
-        # Cloud Connection readonly switch: return True if cloud connected, else False
-        if hasattr(self, 'cloud_switch_map') and idx in self.cloud_switch_map:
-            parent_idx = self.cloud_switch_map[idx]
-            dev = self.device_objs[parent_idx]
-            try:
-                self._safe_async(dev.update())
-            except Exception as update_ex:
-                import types
-                if isinstance(update_ex, types.CoroutineType):
-                    logger.error(f"get_switch: update failed for {getattr(dev, 'alias', dev)}: coroutine was never awaited")
-                else:
-                    logger.error(f"get_switch: update failed for {getattr(dev, 'alias', dev)}: {update_ex}")
-            cloudstatus = dev.features.get('cloud_connection')
-            status = cloudstatus.value
-            return bool(status)
-        # Power (On Since) readonly switch: always ON
-        if hasattr(self, 'readonly_switches') and idx in self.readonly_switches and (not hasattr(self, 'cloud_switch_map') or idx not in self.cloud_switch_map):
-            dev = self.device_objs[idx]
-            try:
-                self._safe_async(dev.update())
-            except Exception as update_ex:
-                import types
-                if isinstance(update_ex, types.CoroutineType):
-                    logger.error(f"get_switch: update failed for {getattr(dev, 'alias', dev)}: coroutine was never awaited")
-                else:
-                    logger.error(f"get_switch: update failed for {getattr(dev, 'alias', dev)}: {update_ex}")
-            return True
-        dev = self.device_objs[idx]
-        if hasattr(self, 'child_map') and idx in self.child_map:
-            dev_idx, cidx = self.child_map[idx]
-            child = dev.children[cidx]
-            logger.debug(f"get_switch: Updating child {child.alias} of {dev.alias}")
-            try:
-                self._safe_async(child.update())
-            except Exception as update_ex:
-                import types
-                if isinstance(update_ex, types.CoroutineType):
-                    logger.error(f"get_switch: update failed for child {child.alias} of {dev.alias}: coroutine was never awaited")
-                else:
-                    logger.error(f"get_switch: update failed for child {child.alias} of {dev.alias}: {update_ex}")
-            logger.debug(f"get_switch: {dev.alias} - {child.alias} is_on={child.is_on}")
-            return child.is_on
-        else:
-            logger.debug(f"get_switch: Updating device {dev.alias}")
-            try:
-                self._safe_async(dev.update())
-            except Exception as update_ex:
-                import types
-                if isinstance(update_ex, types.CoroutineType):
-                    logger.error(f"get_switch: update failed for {getattr(dev, 'alias', dev)}: coroutine was never awaited")
-                else:
-                    logger.error(f"get_switch: update failed for {getattr(dev, 'alias', dev)}: {update_ex}")
-            logger.debug(f"get_switch: {dev.alias} is_on={dev.is_on}")
-            return dev.is_on
-
-    def set_switch(self, state, id=0):
-        import time as _time
-        name = self._resolve_id(id)
-        idx = self.device_list.index(name)
-        # Prevent setting state for readonly (parent) and cloud switches
-        if (hasattr(self, 'readonly_switches') and idx in self.readonly_switches):
-            raise DriverException(0x502, f"Switch {name} is read-only.")
-        dev = self.device_objs[idx]
-        max_retries = 3
-        delay = 1.2  # seconds
-        if hasattr(self, 'child_map') and idx in self.child_map:
-            dev_idx, cidx = self.child_map[idx]
-            dev = self.device_objs[dev_idx]
-            for attempt in range(max_retries):
-                child = dev.children[cidx]
-                logger.info(f"set_switch: Setting child {child.alias} of {dev.alias} to {'ON' if state else 'OFF'} (attempt {attempt+1})")
-                fut = asyncio.run_coroutine_threadsafe(child.turn_on() if state else child.turn_off(), self.loop)
-                fut.result()
-                _time.sleep(delay)
-                fut_update = asyncio.run_coroutine_threadsafe(dev.update(), self.loop)
-                fut_update.result()
-                child = dev.children[cidx]
-                logger.info(f"set_switch: {dev.alias} - {child.alias} is now {'ON' if child.is_on else 'OFF'} (expected {'ON' if state else 'OFF'})")
-                if child.is_on == state:
-                    return
-            logger.error(f"set_switch: State mismatch after {max_retries} attempts for {child.alias} of {dev.alias}: expected {state}, got {child.is_on}")
-            raise DriverException(0x501, f"Failed to set switch state for {child.alias} of {dev.alias}")
-        else:
-            for attempt in range(max_retries):
-                logger.info(f"set_switch: Setting {dev.alias} to {'ON' if state else 'OFF'} (attempt {attempt+1})")
-                fut = asyncio.run_coroutine_threadsafe(dev.turn_on() if state else dev.turn_off(), self.loop)
-                fut.result()
-                _time.sleep(delay)
-                fut_update = asyncio.run_coroutine_threadsafe(dev.update(), self.loop)
-                fut_update.result()
-                logger.info(f"set_switch: {dev.alias} is now {'ON' if dev.is_on else 'OFF'} (expected {'ON' if state else 'OFF'})")
-                if dev.is_on == state:
-                    return
-            logger.error(f"set_switch: State mismatch after {max_retries} attempts for {dev.alias}: expected {state}, got {dev.is_on}")
-            raise DriverException(0x501, f"Failed to set switch state for {dev.alias}")
-
-    def _resolve_id(self, id):
-        if not self.device_list:
-            self.device_list, self.device_objs = self.loop.run_until_complete(self._get_device_list())
-        if isinstance(id, int):
-            if id < 0 or id >= len(self.device_list):
-                raise InvalidValueException(f"Switch id {id} out of range.")
-            return self.device_list[id]
-        elif isinstance(id, str):
-            for dev in self.device_list:
-                if id.lower() == dev.lower():
-                    return dev
-            raise InvalidValueException(f"Switch name or GUID '{id}' not found.")
-        else:
-            raise InvalidValueException(f"Invalid switch id: {id}")
-
-device = KasaSwitchController()
-try:
-    device.connect()
-except Exception as ex:
-    logger.error(f"Startup device.connect() failed: {ex}")
-
-# --------------------
-# Alpaca API Endpoints
-# --------------------
-
-# ISwitch maxswitchvalue endpoint
-@before(PreProcessRequest(maxdev))
-class maxswitchvalue:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        idstr = get_request_field('Id', req)
-        try:
-            id = int(idstr)
-        except:
-            resp.text = PropertyResponse(1, req).json
-            return
-        # For Power and Cloud Connection (readonly) switches, set max value to 1 (toggle)
-        if hasattr(device, 'readonly_switches') and id in device.readonly_switches:
-            resp.text = PropertyResponse(1, req).json
-        else:
-            resp.text = PropertyResponse(1, req).json
-
-# ISwitch minswitchvalue endpoint
-@before(PreProcessRequest(maxdev))
-class minswitchvalue:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        idstr = get_request_field('Id', req)
-        try:
-            id = int(idstr)
-        except:
-            resp.text = PropertyResponse(0, req).json
-            return
-        # For Power and Cloud Connection (readonly) switches, set min value to 0 (toggle)
-        if hasattr(device, 'readonly_switches') and id in device.readonly_switches:
-            resp.text = PropertyResponse(0, req).json
-        else:
-            resp.text = PropertyResponse(0, req).json
-
-# ISwitch switchstep endpoint
-@before(PreProcessRequest(maxdev))
-class switchstep:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        idstr = get_request_field('Id', req)
-        try:
-            id = int(idstr)
-        except:
-            resp.text = PropertyResponse(1, req).json
-            return
-        # For Power and Cloud Connection (readonly) switches, step is 1
-        if hasattr(device, 'readonly_switches') and id in device.readonly_switches:
-            resp.text = PropertyResponse(1, req).json
-        else:
-            resp.text = PropertyResponse(1, req).json
-
-# ISwitch getswitchvalue endpoint
-@before(PreProcessRequest(maxdev))
-class getswitchvalue:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        if not device.is_connected():
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            return
-        idstr = get_request_field('Id', req)
-        try:
-            try:
-                id = int(idstr)
-            except ValueError:
-                id = idstr
-            val = device.get_switch(id)
-            resp.text = PropertyResponse(1 if val else 0, req).json
-        except Exception as ex:
-            resp.text = PropertyResponse(None, req, DriverException(0x500, 'Switch.GetSwitchValue failed', ex)).json
-
-# ISwitch getswitch endpoint
-@before(PreProcessRequest(maxdev))
-class getswitch:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        if not device.is_connected():
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            return
-        idstr = get_request_field('Id', req)
-        try:
-            try:
-                id = int(idstr)
-            except ValueError:
-                id = idstr
-            val = device.get_switch(id)
-            resp.text = PropertyResponse(bool(val), req).json
-        except Exception as ex:
-            resp.text = PropertyResponse(None, req, DriverException(0x500, 'Switch.Getswitch failed', ex)).json
-
-# ISwitch setswitch endpoint
-@before(PreProcessRequest(maxdev))
-class setswitch:
-    def on_put(self, req: Request, resp: Response, devnum: int):
-        if not device.is_connected():
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            return
-        idstr = get_request_field('Id', req)
-        try:
-            try:
-                id = int(idstr)
-            except ValueError:
-                id = idstr
-        except:
-            resp.text = MethodResponse(req, InvalidValueException(f'Id {idstr} not a valid integer or device name.')).json
-            return
-        statestr = get_request_field('State', req)
-        try:
-            if isinstance(statestr, str):
-                if statestr.strip() in ('1', 'true', 'True', 'on', 'ON'):
-                    state = True
-                elif statestr.strip() in ('0', 'false', 'False', 'off', 'OFF'):
-                    state = False
-                else:
-                    raise ValueError
-            else:
-                state = bool(statestr)
-        except:
-            resp.text = MethodResponse(req, InvalidValueException(f'State {statestr} not a valid boolean or 0/1.')).json
-            return
-        if logger:
-            logger.info(f"setswitch endpoint called: idstr={idstr}, parsed_id={id}, state={state}")
-        else:
-            print(f"setswitch endpoint called: idstr={idstr}, parsed_id={id}, state={state}")
-        try:
-            device.set_switch(state, id)
-            resp.text = MethodResponse(req).json
-        except Exception as ex:
-            if logger:
-                logger.error(f"setswitch endpoint: set_switch failed for id={id}, state={state}, ex={ex}")
-            else:
-                print(f"setswitch endpoint: set_switch failed for id={id}, state={state}, ex={ex}")
-            resp.text = MethodResponse(req, DriverException(0x500, 'Switch.Setswitch failed', ex)).json
-
-# ISwitch setswitchvalue endpoint (for Alpaca compliance, digital switches only)
-@before(PreProcessRequest(maxdev))
-class setswitchvalue:
-    def on_put(self, req: Request, resp: Response, devnum: int):
-        if not device.is_connected():
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            return
-        idstr = get_request_field('Id', req)
-        try:
-            try:
-                id = int(idstr)
-            except ValueError:
-                id = idstr
-        except:
-            resp.text = MethodResponse(req, InvalidValueException(f'Id {idstr} not a valid integer or device name.')).json
-            return
-        valstr = get_request_field('Value', req)
-        try:
-            # For digital switches, only 0 or 1 is valid
-            value = int(valstr)
-            if value not in (0, 1):
-                raise ValueError
-        except:
-            resp.text = MethodResponse(req, InvalidValueException(f'Value {valstr} not a valid digital switch value (0 or 1).')).json
-            return
-        state = bool(value)
-        if logger:
-            logger.info(f"setswitchvalue endpoint called: idstr={idstr}, parsed_id={id}, value={value}, state={state}")
-        else:
-            print(f"setswitchvalue endpoint called: idstr={idstr}, parsed_id={id}, value={value}, state={state}")
-        try:
-            device.set_switch(state, id)
-            resp.text = MethodResponse(req).json
-        except Exception as ex:
-            if logger:
-                logger.error(f"setswitchvalue endpoint: set_switch failed for id={id}, value={value}, ex={ex}")
-            else:
-                print(f"setswitchvalue endpoint: set_switch failed for id={id}, value={value}, ex={ex}")
-            resp.text = MethodResponse(req, DriverException(0x500, 'Switch.SetSwitchValue failed', ex)).json
-
-# ISwitch getswitchname endpoint
-@before(PreProcessRequest(maxdev))
-class getswitchname:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        if logger:
-            logger.info(f"getswitchname: handler entry (devnum={devnum})")
-        if not device.is_connected():
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            if logger:
-                logger.info("getswitchname: handler exit (not connected)")
-            return
-        idstr = get_request_field('Id', req)
-        try:
-            id = int(idstr)
-        except:
-            resp.text = MethodResponse(req, InvalidValueException(f'Id {idstr} not a valid integer.')).json
-            if logger:
-                logger.info("getswitchname: handler exit (invalid id)")
-            return
-        try:
-            name = device.device_list[id] if 0 <= id < len(device.device_list) else None
-            if logger:
-                logger.info(f"getswitchname: id={id}, name={name}")
-            # Defensive: if name is None, return a clear error
-            if name is None:
-                resp.text = PropertyResponse(None, req, InvalidValueException(f'Switch id {id} not found.')).json
-                if logger:
-                    logger.info("getswitchname: handler exit (id not found)")
-                return
-            resp.text = PropertyResponse(name, req).json
-            if logger:
-                logger.info("getswitchname: handler exit (success)")
-        except Exception as ex:
-            resp.text = PropertyResponse(None, req, DriverException(0x500, 'Switch.Getswitchname failed', ex)).json
-            if logger:
-                logger.error(f"getswitchname: handler exit (exception: {ex})")
-            else:
-                print(f"getswitchname: handler exit (exception: {ex})")
-
-# ISwitch getswitchdescription endpoint
-@before(PreProcessRequest(maxdev))
-class getswitchdescription:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        if not device.is_connected():
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            return
-        idstr = get_request_field('Id', req)
-        try:
-            id = int(idstr)
-        except:
-            resp.text = MethodResponse(req, InvalidValueException(f'Id {idstr} not a valid integer.')).json
-            return
-        try:
-            if 0 <= id < len(device.device_list):
-                name = device.device_list[id]
-                dev_idx = id
-                dev = device.device_objs[dev_idx] if dev_idx < len(device.device_objs) else None
-                # Cloud Connection switch description
-                if hasattr(device, 'cloud_switch_map') and id in device.cloud_switch_map:
-                    parent_idx = device.cloud_switch_map[id]
-                    parent_dev = device.device_objs[parent_idx]
-                    # Ensure update is awaited
-                    try:
-                        device._safe_async(parent_dev.update())
-                    except Exception as update_ex:
-                        logger.error(f"getswitchdescription: update failed for {getattr(parent_dev, 'alias', parent_dev)}: {update_ex}")
-                    cloudstatus = parent_dev.features.get('cloud_connection')
-                    status_bool = cloudstatus.value
-                    desc = f"Status: {'Connected' if status_bool else 'Disconnected'}"
-                # Power (On Since) readonly switch description
-                elif hasattr(device, 'readonly_switches') and id in device.readonly_switches and (not hasattr(device, 'cloud_switch_map') or id not in device.cloud_switch_map):
-                    on_since = getattr(dev, 'on_since', None) if dev else None
-                    # Format with robust local timezone handling, fallback to UTC/US
-                    if on_since and isinstance(on_since, datetime):
-                        try:
-                            # Convert to local timezone if possible
-                            if TZLOCAL_AVAILABLE:
-                                local_tz = get_localzone()
-                                local_dt = on_since.replace(tzinfo=timezone.utc).astimezone(local_tz)
-                                formatted = local_dt.strftime('%c %Z')
-                            else:
-                                # Fallback to UTC
-                                formatted = on_since.replace(tzinfo=timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
-                        except Exception as ex:
-                            # Fallback to US format
-                            try:
-                                formatted = on_since.strftime('%m/%d/%Y %I:%M:%S %p UTC')
-                            except Exception:
-                                formatted = str(on_since)
-                        desc = f"On since: {formatted}"
-                    else:
-                        desc = "On since: Unknown"
-                else:
-                    # Child or other switch
-                    desc = f"{getattr(dev, 'alias', name)} - {name}"
-                resp.text = PropertyResponse(desc, req).json
-            else:
-                resp.text = PropertyResponse(None, req, InvalidValueException(f'Switch id {id} not found.')).json
-        except Exception as ex:
-            resp.text = PropertyResponse(None, req, DriverException(0x500, 'Switch.GetSwitchDescription failed', ex)).json
-
-# ISwitch canwrite endpoint
-@before(PreProcessRequest(maxdev))
-class canwrite:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        if not device.is_connected():
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            return
-        idstr = get_request_field('Id', req)
-        try:
-            id = int(idstr)
-        except:
-            resp.text = MethodResponse(req, InvalidValueException(f'Id {idstr} not a valid integer.')).json
-            return
-        # Set CanWrite to False for readonly (parent) and cloud switches, True for others
-        can_write = True
-        if (hasattr(device, 'readonly_switches') and id in device.readonly_switches):
-            can_write = False
-        if logger:
-            logger.info(f"canwrite: returning {can_write} for id={id}")
-        resp.text = PropertyResponse(can_write, req).json
-        if logger:
-            logger.info(f"canwrite: response serialized ({can_write})")
-
-# Management endpoints
-class connect:
-    def on_put(self, req: Request, resp: Response, devnum: int):
-        try:
-            device.connect()
-            resp.text = MethodResponse(req).json
-        except Exception as ex:
-            resp.text = MethodResponse(req, DriverException(0x500, 'Switch.Connect failed', ex)).json
-
-@before(PreProcessRequest(maxdev))
-class connected:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        try:
-            is_conn = device.is_connected()
-            resp.status = "200 OK"
-            resp.content_type = "application/json"
-            resp.text = PropertyResponse(is_conn, req).json
-            if logger:
-                logger.info(f"GET /connected response: {resp.text}")
-            else:
-                print(f"GET /connected response: {resp.text}")
-        except Exception as ex:
-            resp.status = "200 OK"
-            resp.content_type = "application/json"
-            resp.text = MethodResponse(req, DriverException(0x500, 'Switch.Connected failed', ex)).json
-            if logger:
-                logger.error(f"GET /connected error response: {resp.text}")
-            else:
-                print(f"GET /connected error response: {resp.text}")
-
-    def on_put(self, req: Request, resp: Response, devnum: int):
-        conn_str = get_request_field('Connected', req)
-        conn = to_bool(conn_str)
-        import os
-        try:
-            if conn:
-                if not device.is_connected():
-                    device.connect()
-                resp.status = "200 OK"
-                resp.content_type = "application/json"
-                resp.text = MethodResponse(req).json
-                if logger:
-                    logger.info(f"PUT /connected response: {resp.text}")
-                else:
-                    print(f"PUT /connected response: {resp.text}")
-            else:
-                if device.is_connected():
-                    device.disconnect()
-                resp.status = "200 OK"
-                resp.content_type = "application/json"
-                resp.text = MethodResponse(req).json
-                if logger:
-                    logger.info(f"PUT /connected response: {resp.text}")
-                else:
-                    print(f"PUT /connected response: {resp.text}")
-                logger.info("Connected endpoint: shutting down Python process after disconnect.")
-                os._exit(0)
-        except Exception as ex:
-            resp.status = "200 OK"
-            resp.content_type = "application/json"
-            resp.text = MethodResponse(req, DriverException(0x500, 'Switch.Connected failed', ex)).json
-            if logger:
-                logger.error(f"PUT /connected error response: {resp.text}")
-            else:
-                print(f"PUT /connected error response: {resp.text}")
-
-@before(PreProcessRequest(maxdev))
-class disconnect:
-    def on_put(self, req: Request, resp: Response, devnum: int):
-        import os
-        try:
-            device.disconnect()
-            resp.text = MethodResponse(req).json
-            logger.info("Disconnect endpoint: shutting down Python process.")
-            os._exit(0)
-        except Exception as ex:
-            resp.text = MethodResponse(req, DriverException(0x500, 'Switch.Disconnect failed', ex)).json
-
-# Metadata endpoints
-@before(PreProcessRequest(maxdev))
-class driverinfo:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        resp.text = PropertyResponse(SwitchMetadata.Info, req).json
-
-@before(PreProcessRequest(maxdev))
-class interfaceversion:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        resp.text = PropertyResponse(SwitchMetadata.InterfaceVersion, req).json
-
-@before(PreProcessRequest(maxdev))
-class driverversion:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        resp.text = PropertyResponse(SwitchMetadata.Version, req).json
-
-@before(PreProcessRequest(maxdev))
-class name:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        resp.text = PropertyResponse(SwitchMetadata.Name, req).json
-
-@before(PreProcessRequest(maxdev))
-class supportedactions:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        resp.text = PropertyResponse([], req).json
-
-@before(PreProcessRequest(maxdev))
-class maxswitch:
-    def on_get(self, req: Request, resp: Response, devnum: int):
-        if not device.is_connected():
-            if logger:
-                logger.warning("maxswitch: device not connected")
-            resp.text = PropertyResponse(None, req, NotConnectedException()).json
-            return
-        try:
-            val = len(device.device_list)
-            if logger:
-                logger.info(f"maxswitch: returning {val}")
-            resp.text = PropertyResponse(val, req).json
-        except Exception as ex:
-            if logger:
-                logger.error(f"maxswitch: failed: {ex}")
-            resp.text = PropertyResponse(None, req, DriverException(0x500, 'Switch.Maxswitch failed', ex)).json
-
-# CLI for credential management
-if __name__ == "__main__":
-    import argparse
-    parser = argparse.ArgumentParser(description="Kasa Switch Utility")
-    parser.add_argument("credentials", action="store_true", help="Update Kasa credentials in keyring")
-    args = parser.parse_args()
-    if args.credentials:
-        KasaSwitchController().update_credentials()
-        print("Credentials updated.")
-        exit(0)
-
+# --------------------
+# Imports
+# --------------------
+import asyncio
+import keyring
+from kasa import Discover, SmartPlug
+from datetime import datetime, timezone
+import getpass
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+import logging
+try:
+    from tzlocal import get_localzone
+    TZLOCAL_AVAILABLE = True
+except ImportError:
+    TZLOCAL_AVAILABLE = False
+
+# tzlocal probes environment and tz files on every get_localzone() call,
+# so resolve the zone once at import instead of per request.
+_LOCAL_TZ = get_localzone() if TZLOCAL_AVAILABLE else None
+from falcon import Request, Response, HTTPBadRequest, before
+import json
+from .shr import PropertyResponse, MethodResponse, PreProcessRequest, StateValue, get_request_field, to_bool, getNextTransId, _write_json
+from .exceptions import *
+
+# --------------------
+# Globals and Metadata
+# --------------------
+
+# Bound at import so log calls never need a None guard; app.main()
+# rebinds this to the shared rotating-file logger at startup.
+logger: Logger = logging.getLogger("kasa-alpaca")
+if not logger.hasHandlers():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s'
+    )
+
+maxdev = 0  # Single instance
+
+# Accepted setswitch State spellings (compared lowercased); .get() returns
+# None for anything unrecognized
+_BOOL_MAP = {'1': True, 'true': True, 'on': True,
+             '0': False, 'false': False, 'off': False}
+
+# Strict Alpaca booleans for Connected: only 'true'/'false' are valid,
+# matching to_bool(); _BOOL_MAP above is deliberately laxer for State.
+_ALPACA_BOOL = {'true': True, 'false': False}
+
+def _parse_id(idstr: str):
+    """Return the Id field as an int index when numeric, else as a name.
+
+    String-named switches are the common case, so pre-test with isdigit()
+    rather than raising and catching ValueError on every request. The
+    try/except keeps the helper total: oddities that pass the pre-test
+    but not int() (e.g. '--5') fall through to the name path, where the
+    usual InvalidValueException handling applies.
+    """
+    if idstr.strip().lstrip('+-').isdigit():
+        try:
+            return int(idstr)
+        except ValueError:
+            pass
+    return idstr
+
+
+def _field(name: str, req: Request):
+    """Read a field from the dict PreProcessRequest already parsed.
+
+    Falls back to get_request_field() only when the field is absent,
+    so a missing required field still produces the usual 400 response.
+    """
+    val = req.context.fields.get(name)
+    if val is None:
+        val = get_request_field(name, req)
+    return val
+
+
+# Pre-rendered PropertyResponse bodies for constant-valued endpoints;
+# only the two transaction ids vary per request, so substitute those
+# into a cached template instead of re-encoding JSON every poll.
+_CONST_TEMPLATES = {}
+
+def _const_json(value, req):
+    # Key on the type as well: True and 1 are equal as dict keys but
+    # serialize differently.
+    key = (value.__class__, value)
+    tmpl = _CONST_TEMPLATES.get(key)
+    if tmpl is None:
+        tmpl = ('{{"ServerTransactionID": {stid}, "ClientTransactionID": {ctid}, '
+                + f'"Value": {json.dumps(value)}, '
+                + '"ErrorNumber": 0, "ErrorMessage": ""}}')
+        _CONST_TEMPLATES[key] = tmpl
+    ctid = int(get_request_field('ClientTransactionID', req, False, 0))
+    return tmpl.format(stid=getNextTransId(), ctid=ctid).encode()
+
+
+# Empty-success MethodResponse body shared by the PUT handlers; as with
+# _const_json, only the two transaction ids vary per request.
+_OK_TEMPLATE = ('{{"ServerTransactionID": {stid}, "ClientTransactionID": {ctid}, '
+                '"ErrorNumber": 0, "ErrorMessage": ""}}')
+
+def _ok_json(req):
+    ctid = int(get_request_field('ClientTransactionID', req, False, 0))
+    return _OK_TEMPLATE.format(stid=getNextTransId(), ctid=ctid).encode()
+
+
+# supportedactions always returns an empty array; lists can't key the
+# _CONST_TEMPLATES cache, so it gets its own template.
+_EMPTY_LIST_TEMPLATE = ('{{"ServerTransactionID": {stid}, "ClientTransactionID": {ctid}, '
+                        '"Value": [], "ErrorNumber": 0, "ErrorMessage": ""}}')
+
+def _empty_list_json(req):
+    ctid = int(get_request_field('ClientTransactionID', req, False, 0))
+    return _EMPTY_LIST_TEMPLATE.format(stid=getNextTransId(), ctid=ctid).encode()
+
+
+# DriverException(0x500) failure body for the connection handlers. The
+# structure and error number are static; only the transaction ids and the
+# exception text vary, so render from a template instead of constructing
+# DriverException + MethodResponse objects on every failure. The message
+# matches what DriverException would have produced; callers log it.
+_ERR_TEMPLATE = ('{{"ServerTransactionID": {stid}, "ClientTransactionID": {ctid}, '
+                 '"ErrorNumber": 1280, "ErrorMessage": {msg}}}')
+
+def _err_json(message, ex, req):
+    ctid = int(get_request_field('ClientTransactionID', req, False, 0))
+    msg = json.dumps(f'DriverException: {message}\n{type(ex).__name__}: {ex}')
+    return _ERR_TEMPLATE.format(stid=getNextTransId(), ctid=ctid, msg=msg).encode()
+
+class SwitchMetadata:
+    Name = 'Kasa Switch'
+    Version = '1.0.0'
+    Description = 'ASCOM Alpaca driver for Kasa switches'
+    DeviceType = 'Switch'
+    DeviceID = 'b7e1e2c2-7e2a-4b7a-9e2e-123456789abc'  # Replace with your own GUID if desired
+    Info = 'Kasa Switch Alpaca Device\nImplements ISwitch\nASCOM Initiative'
+    MaxDeviceNumber = maxdev
+    InterfaceVersion = 1
+
+# --------------------
+# KasaSwitchController
+# --------------------
+
+
+# Credentials memoized at module scope: every keyring.get_password opens a
+# fresh Secret-Service/DBus session, so hit the backend once per process
+# and share the result across controller instances. update_credentials()
+# refreshes the cache after a rewrite.
+_CRED_CACHE = {}
+_CRED_LOCK = threading.Lock()
+
+def get_cached_credential(key):
+    with _CRED_LOCK:
+        val = _CRED_CACHE.get(key)
+        if val is None:
+            try:
+                val = keyring.get_password('kasa-alpaca', key)
+            except Exception as ex:
+                # Some keyring backends wedge once an asyncio loop has run
+                # in the process; fall back to the environment instead of
+                # failing the whole startup.
+                logger.warning("keyring read for %s failed (%s); trying environment", key, ex)
+                val = os.environ.get(f'KASA_{key.upper()}')
+            if val:
+                _CRED_CACHE[key] = val
+        return val
+
+class KasaSwitchController:
+    """Manages Kasa switches via python-kasa library."""
+    def __init__(self):
+        self.connected = False
+        self.device_list = []
+        self.device_objs = []
+        self.descriptions = []
+        self._device_count = 0  # len(device_list), cached for maxswitch polls
+        # Always present so the hot paths can use plain membership tests;
+        # connect() rebuilds them with real contents.
+        self.readonly_switches = set()
+        self.cloud_switch_map = {}
+        self.child_map = {}
+        self._name_to_idx_ci = {}  # name.lower() -> first index in device_list
+        # Guards publication of the per-switch state built by connect()
+        # and its teardown in disconnect(). Re-entrant so a holder can
+        # call back into methods that also take it.
+        self.lock = threading.RLock()
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._loop_thread.start()
+        self.email = None
+        self.password = None
+        # Freshness window for device refreshes: Alpaca clients poll every
+        # switch id in a tight loop, so requests within the TTL reuse a
+        # single update() round-trip per device. The one-second default
+        # comfortably covers a full poll sweep while staying fresher than
+        # typical client polling intervals; KASA_UPDATE_TTL overrides it
+        # (0 disables caching for strict freshness).
+        try:
+            self._update_ttl = float(os.environ.get('KASA_UPDATE_TTL', 1.0))
+        except ValueError:
+            logger.warning("Bad KASA_UPDATE_TTL %r; using 1.0s",
+                           os.environ['KASA_UPDATE_TTL'])
+            self._update_ttl = 1.0
+        self._update_ts = {}
+        self._last_full_refresh = 0.0
+        # In-flight update() futures keyed by id(dev); concurrent callers
+        # for the same device await one shared refresh (single-flight).
+        # Only touched on the loop thread.
+        self._inflight = {}
+        # Per-device locks: commands to the same device stay ordered while
+        # different devices can be switched concurrently. asyncio.Lock,
+        # since they are only taken inside coroutines on the loop thread.
+        self._dev_locks = defaultdict(asyncio.Lock)
+        # Monotonic stamp of the last successful connect(); recent
+        # re-entries short-circuit instead of re-running discovery.
+        self._connect_ts = 0.0
+        self._load_credentials()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _load_credentials(self):
+        self.email = get_cached_credential('email')
+        self.password = get_cached_credential('password')
+        if not self.email or not self.password:
+            self._prompt_and_store_credentials()
+
+    def _prompt_and_store_credentials(self):
+        email = input('Enter Kasa account email: ')
+        password = getpass.getpass('Password: ')
+        keyring.set_password('kasa-alpaca', 'email', email)
+        keyring.set_password('kasa-alpaca', 'password', password)
+        self.email = email
+        self.password = password
+        with _CRED_LOCK:
+            _CRED_CACHE['email'] = email
+            _CRED_CACHE['password'] = password
+
+    def update_credentials(self):
+        self._prompt_and_store_credentials()
+
+    # Re-running discovery within this window is pure overhead: the
+    # device set doesn't churn that fast and each pass costs seconds.
+    _RECONNECT_TTL = 60.0
+
+    def connect(self, force=False):
+        logger.info("connect() called.")
+        global maxdev
+        if (self.connected and not force
+                and time.monotonic() - self._connect_ts < self._RECONNECT_TTL):
+            logger.info("connect(): already connected %.0fs ago; skipping rediscovery.",
+                        time.monotonic() - self._connect_ts)
+            return
+        logger.info("connect() using event loop: %s", self.loop)
+        start = time.time()
+        # Discovery and mapping run on locals so requests keep serving the
+        # previous state (or NotConnected) for the seconds this takes; the
+        # lock is only held for the final atomic publish below.
+        try:
+            fut = asyncio.run_coroutine_threadsafe(self._get_device_list(), self.loop)
+            raw_list, raw_objs = fut.result()
+            child_map = {}  # Map device_list index to (dev_idx, child_idx)
+            new_device_list = []
+            new_device_objs = []
+            readonly_switches = set()  # Track readonly switches (parent devices)
+            cloud_switch_map = {}  # Map: index -> parent idx for cloud connection switches
+            for idx, dev in enumerate(raw_objs):
+                # Add Power (On Since) as a readonly switch for the parent
+                new_device_list.append("Power")
+                new_device_objs.append(dev)
+                readonly_switches.add(len(new_device_list)-1)
+                parent_idx = len(new_device_list)-1
+                # Add Cloud Connection as a readonly switch for the parent
+                new_device_list.append("Cloud Connection")
+                new_device_objs.append(dev)
+                readonly_switches.add(len(new_device_list)-1)
+                cloud_switch_map[len(new_device_list)-1] = parent_idx
+                if hasattr(dev, 'children') and dev.children:
+                    for cidx, child in enumerate(dev.children):
+                        name = f"{child.alias}"
+                        new_device_list.append(name)
+                        child_map[len(new_device_list)-1] = (idx, cidx)
+                        new_device_objs.append(dev)
+            # Static per-switch descriptions (the dynamic readonly ones
+            # are built per request); device_list is fixed until the next
+            # connect, so compute these once instead of per GET.
+            descriptions = [
+                f"{getattr(obj, 'alias', name)} - {name}"
+                for name, obj in zip(new_device_list, new_device_objs)
+            ]
+            # First occurrence wins, matching list.index() for the
+            # duplicated Power/Cloud Connection entries.
+            name_to_idx_ci = {}
+            for i, n in enumerate(new_device_list):
+                name_to_idx_ci.setdefault(n.lower(), i)
+        except Exception as ex:
+            self.connected = False
+            logger.error("Connect failed after %.2fs: %s", time.time() - start, ex)
+            raise DriverException(0x500, f"python-kasa devicelist failed: {ex}")
+        with self.lock:
+            self.device_list = new_device_list
+            self.device_objs = new_device_objs
+            self.child_map = child_map
+            self.cloud_switch_map = cloud_switch_map
+            # Immutable from here on; frozenset also makes accidental
+            # post-connect mutation fail loudly.
+            self.readonly_switches = frozenset(readonly_switches)
+            self.descriptions = descriptions
+            self._name_to_idx_ci = name_to_idx_ci
+            self._update_ts.clear()
+            self._last_full_refresh = 0.0
+            self.connected = True
+            self._connect_ts = time.monotonic()
+            maxdev = len(new_device_list)
+            self._device_count = maxdev
+            SwitchMetadata.MaxDeviceNumber = maxdev
+        logger.info("Device list loaded in %.2fs: %s", time.time() - start, new_device_list)
+
+    def disconnect(self):
+        with self.lock:
+            logger.info("disconnect() called.")
+            self.connected = False
+            # Close device transports explicitly rather than leaving them
+            # to garbage collection (not all python-kasa versions expose
+            # disconnect(), hence the getattr guard).
+            for dev in {id(d): d for d in self.device_objs}.values():
+                close = getattr(dev, 'disconnect', None)
+                if close is None:
+                    continue
+                try:
+                    asyncio.run_coroutine_threadsafe(close(), self.loop).result(timeout=2)
+                except Exception as ex:
+                    logger.error("disconnect: closing %s failed: %s", getattr(dev, 'alias', dev), ex)
+            self.device_list = []
+            self.device_objs = []
+            self.descriptions = []
+            self._device_count = 0
+            self.readonly_switches = set()
+            self.cloud_switch_map = {}
+            self.child_map = {}
+            self._name_to_idx_ci = {}
+            self._update_ts.clear()
+            self._last_full_refresh = 0.0
+            # The loop thread stays up for the life of the process;
+            # disconnect only drops device state, so a later connect()
+            # reuses the same loop instead of churning threads.
+            logger.info("disconnect() cleared device state; event loop kept alive.")
+
+    def is_connected(self):
+        return self.connected
+
+    async def _get_device_list(self):
+        devices = []
+        device_objs = []
+        try:
+            found = await Discover.discover()
+            logger.info("Discover.discover() returned: %s", found)
+            if not found:
+                logger.warning("No devices discovered.")
+                return devices, device_objs
+            # Refresh all discovered devices concurrently so the waits
+            # overlap: connect() costs roughly one round-trip instead of
+            # one per device.
+            items = list(found.items())
+            results = await asyncio.gather(*(dev.update() for _, dev in items), return_exceptions=True)
+            for (addr, dev), result in zip(items, results):
+                if isinstance(result, Exception):
+                    logger.error("Device update failed for %s: %s", getattr(dev, 'alias', addr), result)
+                    continue
+                logger.info("Device updated: %s", getattr(dev, 'alias', addr))
+                devices.append(dev.alias)
+                device_objs.append(dev)
+            logger.info("Discovered devices: %s", devices)
+            return devices, device_objs
+        except Exception as ex:
+            logger.error("Device discovery failed: %s", ex)
+            return devices, device_objs
+
+    def _safe_async(self, coro):
+        """Run an async coroutine safely from sync context using the dedicated event loop."""
+        # Always use run_coroutine_threadsafe for self.loop
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return fut.result()
+
+    def _refresh(self, dev):
+        """Run dev.update() at most once per TTL window for each device."""
+        self._safe_async(self._arefresh(dev))
+
+    async def _arefresh(self, dev):
+        """Async counterpart of _refresh for code already on the loop."""
+        key = id(dev)
+        if time.monotonic() - self._update_ts.get(key, 0.0) < self._update_ttl:
+            return
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # Piggyback on the refresh already running for this device.
+            await inflight
+            return
+        fut = self.loop.create_future()
+        self._inflight[key] = fut
+        try:
+            await dev.update()
+            self._update_ts[key] = time.monotonic()
+            fut.set_result(None)
+        except Exception as ex:
+            fut.set_exception(ex)
+            fut.exception()  # mark retrieved for the no-waiter case
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _arefresh_all(self):
+        """Refresh every unique device concurrently, at most once per TTL.
+
+        The first getswitch/getswitchvalue in a client polling sweep pays
+        one parallel batch; the rest of the sweep is served from the
+        per-device cache.
+        """
+        now = time.monotonic()
+        if now - self._last_full_refresh < self._update_ttl:
+            return
+        self._last_full_refresh = now
+        devs = list({id(d): d for d in self.device_objs}.values())
+        if not devs:
+            return
+        results = await asyncio.gather(*(self._arefresh(d) for d in devs), return_exceptions=True)
+        for d, r in zip(devs, results):
+            if isinstance(r, Exception):
+                logger.error("refresh_all: update failed for %s: %s", getattr(d, 'alias', d), r)
+
+    def _mark_fresh(self, dev):
+        """Record that dev was just updated (e.g. after a confirmed set)."""
+        self._update_ts[id(dev)] = time.monotonic()
+
+    def get_switch(self, id=0):
+        return self._safe_async(self.aget_switch(id))
+
+    async def aget_switch(self, id=0):
+        idx = self._resolve_idx(id)
+        await self._arefresh_all()
+        # Cloud Connection readonly switch: return True if cloud connected, else False
+        if idx in self.cloud_switch_map:
+            parent_idx = self.cloud_switch_map[idx]
+            dev = self.device_objs[parent_idx]
+            try:
+                await self._arefresh(dev)
+            except Exception as update_ex:
+                logger.error("get_switch: update failed for %s: %s", getattr(dev, 'alias', dev), update_ex)
+            cloudstatus = dev.features.get('cloud_connection')
+            status = cloudstatus.value
+            return bool(status)
+        # Power (On Since) readonly switch: always ON
+        if idx in self.readonly_switches and idx not in self.cloud_switch_map:
+            dev = self.device_objs[idx]
+            try:
+                await self._arefresh(dev)
+            except Exception as update_ex:
+                logger.error("get_switch: update failed for %s: %s", getattr(dev, 'alias', dev), update_ex)
+            return True
+        dev = self.device_objs[idx]
+        if idx in self.child_map:
+            dev_idx, cidx = self.child_map[idx]
+            child = dev.children[cidx]
+            logger.debug("get_switch: Updating child %s of %s", child.alias, dev.alias)
+            try:
+                await self._arefresh(child)
+            except Exception as update_ex:
+                logger.error("get_switch: update failed for child %s of %s: %s", child.alias, dev.alias, update_ex)
+            logger.debug("get_switch: %s - %s is_on=%s", dev.alias, child.alias, child.is_on)
+            return child.is_on
+        else:
+            logger.debug("get_switch: Updating device %s", dev.alias)
+            try:
+                await self._arefresh(dev)
+            except Exception as update_ex:
+                logger.error("get_switch: update failed for %s: %s", getattr(dev, 'alias', dev), update_ex)
+            logger.debug("get_switch: %s is_on=%s", dev.alias, dev.is_on)
+            return dev.is_on
+
+    def set_switch(self, state, id=0):
+        return self._safe_async(self.aset_switch(state, id))
+
+    # Verify-poll schedule after a turn_on/turn_off: first check is an
+    # immediate yield, then growing waits bounded at ~0.3s per attempt.
+    _VERIFY_DELAYS = (0.0, 0.02, 0.04, 0.08, 0.16)
+
+    async def aset_switch(self, state, id=0):
+        idx = self._resolve_idx(id)
+        name = self.device_list[idx]
+        # Prevent setting state for readonly (parent) and cloud switches
+        if idx in self.readonly_switches:
+            raise DriverException(0x502, f"Switch {name} is read-only.")
+        dev = self.device_objs[idx]
+        max_retries = 3
+        # Serialize same-device commands only; key on the parent device
+        parent = self.device_objs[self.child_map[idx][0]] if idx in self.child_map else dev
+        async with self._dev_locks[getattr(parent, 'alias', idx)]:
+            if idx in self.child_map:
+                dev_idx, cidx = self.child_map[idx]
+                dev = self.device_objs[dev_idx]
+                for attempt in range(max_retries):
+                    child = dev.children[cidx]
+                    logger.debug("set_switch: Setting child %s of %s to %s (attempt %d)", child.alias, dev.alias, 'ON' if state else 'OFF', attempt + 1)
+                    await (child.turn_on() if state else child.turn_off())
+                    for delay in self._VERIFY_DELAYS:
+                        await asyncio.sleep(delay)
+                        await dev.update()
+                        self._mark_fresh(dev)
+                        child = dev.children[cidx]
+                        if child.is_on == state:
+                            logger.debug("set_switch: %s - %s is now %s", dev.alias, child.alias, 'ON' if state else 'OFF')
+                            return
+                logger.error("set_switch: State mismatch after %d attempts for %s of %s: expected %s, got %s", max_retries, child.alias, dev.alias, state, child.is_on)
+                raise DriverException(0x501, f"Failed to set switch state for {child.alias} of {dev.alias}")
+            else:
+                for attempt in range(max_retries):
+                    logger.debug("set_switch: Setting %s to %s (attempt %d)", dev.alias, 'ON' if state else 'OFF', attempt + 1)
+                    await (dev.turn_on() if state else dev.turn_off())
+                    for delay in self._VERIFY_DELAYS:
+                        await asyncio.sleep(delay)
+                        await dev.update()
+                        self._mark_fresh(dev)
+                        if dev.is_on == state:
+                            logger.debug("set_switch: %s is now %s", dev.alias, 'ON' if state else 'OFF')
+                            return
+                logger.error("set_switch: State mismatch after %d attempts for %s: expected %s, got %s", max_retries, dev.alias, state, dev.is_on)
+                raise DriverException(0x501, f"Failed to set switch state for {dev.alias}")
+
+    def _resolve_idx(self, id):
+        """Resolve an int id or switch name to its device_list index."""
+        if isinstance(id, int):
+            if id < 0 or id >= len(self.device_list):
+                raise InvalidValueException(f"Switch id {id} out of range.")
+            return id
+        elif isinstance(id, str):
+            idx = self._name_to_idx_ci.get(id.lower())
+            if idx is None:
+                raise InvalidValueException(f"Switch name or GUID '{id}' not found.")
+            return idx
+        else:
+            raise InvalidValueException(f"Invalid switch id: {id}")
+
+device = KasaSwitchController()
+
+def _startup_connect():
+    try:
+        device.connect()
+    except Exception as ex:
+        logger.error("Startup device.connect() failed: %s", ex)
+
+# Warm up in the background so the server can start accepting requests
+# while discovery runs; endpoints return NotConnectedException until
+# connect() flips the flag.
+threading.Thread(target=_startup_connect, name='kasa-connect', daemon=True).start()
+
+
+def _require_int_id(req, resp):
+    """Shared prologue for the integer-Id endpoints.
+
+    Runs the connected check, pulls the required Id field and parses it
+    as an int. On failure it writes the error response itself and
+    returns None, so handlers just bail with `if id is None: return`.
+    """
+    if not device.connected:
+        resp.data = PropertyResponse(None, req, NotConnectedException()).json_bytes
+        return None
+    idstr = _field('Id', req)
+    # _parse_id is total, so malformed ids come back as strings and get
+    # the invalid-integer response instead of crashing int().
+    id = _parse_id(idstr)
+    if isinstance(id, int):
+        return id
+    resp.data = MethodResponse(req, InvalidValueException(f'Id {idstr} not a valid integer.')).json_bytes
+    return None
+
+
+# --------------------
+# Alpaca API Endpoints
+# --------------------
+
+# ISwitch maxswitchvalue endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class maxswitchvalue:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        # Digital switches: the max value is the same constant for
+        # every id, including the readonly Power/Cloud Connection rows.
+        get_request_field('Id', req)  # still a required field
+        resp.data = _const_json(1, req)
+
+# ISwitch minswitchvalue endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class minswitchvalue:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        # Digital switches: the min value is the same constant for
+        # every id, including the readonly Power/Cloud Connection rows.
+        get_request_field('Id', req)  # still a required field
+        resp.data = _const_json(0, req)
+
+# ISwitch switchstep endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class switchstep:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        # Digital switches: the step value is the same constant for
+        # every id, including the readonly Power/Cloud Connection rows.
+        get_request_field('Id', req)  # still a required field
+        resp.data = _const_json(1, req)
+
+# ISwitch getswitchvalue endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class getswitchvalue:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        if not device.connected:
+            resp.data = PropertyResponse(None, req, NotConnectedException()).json_bytes
+            return
+        idstr = get_request_field('Id', req)
+        try:
+            id = _parse_id(idstr)
+            val = device.get_switch(id)
+            resp.data = PropertyResponse(1 if val else 0, req).json_bytes
+        except Exception as ex:
+            resp.data = PropertyResponse(None, req, DriverException(0x500, 'Switch.GetSwitchValue failed', ex)).json_bytes
+
+# ISwitch getswitch endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class getswitch:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        if not device.connected:
+            resp.data = PropertyResponse(None, req, NotConnectedException()).json_bytes
+            return
+        idstr = get_request_field('Id', req)
+        try:
+            id = _parse_id(idstr)
+            val = device.get_switch(id)
+            resp.data = PropertyResponse(bool(val), req).json_bytes
+        except Exception as ex:
+            resp.data = PropertyResponse(None, req, DriverException(0x500, 'Switch.Getswitch failed', ex)).json_bytes
+
+# ISwitch setswitch endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class setswitch:
+    def on_put(self, req: Request, resp: Response, devnum: int):
+        if not device.connected:
+            resp.data = PropertyResponse(None, req, NotConnectedException()).json_bytes
+            return
+        idstr = _field('Id', req)
+        id = _parse_id(idstr)
+        statestr = _field('State', req)
+        if isinstance(statestr, str):
+            state = _BOOL_MAP.get(statestr.strip().lower())
+        else:
+            state = bool(statestr)
+        if state is None:
+            resp.data = MethodResponse(req, InvalidValueException(f'State {statestr} not a valid boolean or 0/1.')).json_bytes
+            return
+        logger.debug("setswitch endpoint called: idstr=%s, parsed_id=%s, state=%s", idstr, id, state)
+        try:
+            device.set_switch(state, id)
+            resp.data = _ok_json(req)
+        except Exception as ex:
+            logger.error("setswitch endpoint: set_switch failed for id=%s, state=%s, ex=%s", id, state, ex)
+            resp.data = MethodResponse(req, DriverException(0x500, 'Switch.Setswitch failed', ex)).json_bytes
+
+# ISwitch setswitchvalue endpoint (for Alpaca compliance, digital switches only)
+@before(PreProcessRequest(lambda: maxdev))
+class setswitchvalue:
+    def on_put(self, req: Request, resp: Response, devnum: int):
+        if not device.connected:
+            resp.data = PropertyResponse(None, req, NotConnectedException()).json_bytes
+            return
+        idstr = _field('Id', req)
+        id = _parse_id(idstr)
+        valstr = _field('Value', req)
+        # For digital switches, only 0 or 1 is valid
+        value = valstr.strip() if isinstance(valstr, str) else str(valstr)
+        if value not in ('0', '1'):
+            resp.data = MethodResponse(req, InvalidValueException(f'Value {valstr} not a valid digital switch value (0 or 1).')).json_bytes
+            return
+        value = int(value)
+        state = bool(value)
+        logger.debug("setswitchvalue endpoint called: idstr=%s, parsed_id=%s, value=%s, state=%s", idstr, id, value, state)
+        try:
+            device.set_switch(state, id)
+            resp.data = _ok_json(req)
+        except Exception as ex:
+            logger.error("setswitchvalue endpoint: set_switch failed for id=%s, value=%s, ex=%s", id, value, ex)
+            resp.data = MethodResponse(req, DriverException(0x500, 'Switch.SetSwitchValue failed', ex)).json_bytes
+
+# ISwitch getswitchname endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class getswitchname:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        logger.debug("getswitchname: handler entry (devnum=%s)", devnum)
+        id = _require_int_id(req, resp)
+        if id is None:
+            logger.debug("getswitchname: handler exit (prologue failed)")
+            return
+        try:
+            name = device.device_list[id] if 0 <= id < len(device.device_list) else None
+            logger.debug("getswitchname: id=%s, name=%s", id, name)
+            # Defensive: if name is None, return a clear error
+            if name is None:
+                resp.data = PropertyResponse(None, req, InvalidValueException(f'Switch id {id} not found.')).json_bytes
+                logger.debug("getswitchname: handler exit (id not found)")
+                return
+            resp.data = PropertyResponse(name, req).json_bytes
+            logger.debug("getswitchname: handler exit (success)")
+        except Exception as ex:
+            resp.data = PropertyResponse(None, req, DriverException(0x500, 'Switch.Getswitchname failed', ex)).json_bytes
+            logger.error("getswitchname: handler exit (exception: %s)", ex)
+
+# ISwitch getswitchdescription endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class getswitchdescription:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        id = _require_int_id(req, resp)
+        if id is None:
+            return
+        try:
+            cloud_map = device.cloud_switch_map
+            if 0 <= id < len(device.device_list):
+                name = device.device_list[id]
+                dev_idx = id
+                dev = device.device_objs[dev_idx] if dev_idx < len(device.device_objs) else None
+                # Cloud Connection switch description
+                if id in cloud_map:
+                    parent_idx = cloud_map[id]
+                    parent_dev = device.device_objs[parent_idx]
+                    try:
+                        device._refresh(parent_dev)
+                    except Exception as update_ex:
+                        logger.error("getswitchdescription: update failed for %s: %s", getattr(parent_dev, 'alias', parent_dev), update_ex)
+                    cloudstatus = parent_dev.features.get('cloud_connection')
+                    status_bool = cloudstatus.value
+                    desc = f"Status: {'Connected' if status_bool else 'Disconnected'}"
+                # Power (On Since) readonly switch description
+                elif id in device.readonly_switches and id not in cloud_map:
+                    if dev is not None:
+                        try:
+                            device._refresh(dev)
+                        except Exception as update_ex:
+                            logger.error("getswitchdescription: update failed for %s: %s", getattr(dev, 'alias', dev), update_ex)
+                    on_since = getattr(dev, 'on_since', None) if dev else None
+                    # Format with robust local timezone handling, fallback to UTC/US
+                    if on_since and isinstance(on_since, datetime):
+                        try:
+                            # Convert to local timezone if possible
+                            if _LOCAL_TZ is not None:
+                                local_dt = on_since.replace(tzinfo=timezone.utc).astimezone(_LOCAL_TZ)
+                                formatted = local_dt.strftime('%c %Z')
+                            else:
+                                # Fallback to UTC
+                                formatted = on_since.replace(tzinfo=timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+                        except Exception as ex:
+                            # Fallback to US format
+                            try:
+                                formatted = on_since.strftime('%m/%d/%Y %I:%M:%S %p UTC')
+                            except Exception:
+                                formatted = str(on_since)
+                        desc = f"On since: {formatted}"
+                    else:
+                        desc = "On since: Unknown"
+                else:
+                    # Child or other switch: precomputed in connect()
+                    desc = device.descriptions[id]
+                resp.data = PropertyResponse(desc, req).json_bytes
+            else:
+                resp.data = PropertyResponse(None, req, InvalidValueException(f'Switch id {id} not found.')).json_bytes
+        except Exception as ex:
+            resp.data = PropertyResponse(None, req, DriverException(0x500, 'Switch.GetSwitchDescription failed', ex)).json_bytes
+
+# ISwitch canwrite endpoint
+@before(PreProcessRequest(lambda: maxdev))
+class canwrite:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        id = _require_int_id(req, resp)
+        if id is None:
+            return
+        # CanWrite is False for readonly (parent) and cloud switches, True for others
+        can_write = id not in device.readonly_switches
+        logger.debug("canwrite: returning %s for id=%s", can_write, id)
+        resp.data = _const_json(can_write, req)
+
+# Management endpoints
+class connect:
+    def on_put(self, req: Request, resp: Response, devnum: int):
+        try:
+            device.connect()
+            resp.data = _ok_json(req)
+        except Exception as ex:
+            resp.data = MethodResponse(req, DriverException(0x500, 'Switch.Connect failed', ex)).json_bytes
+
+@before(PreProcessRequest(lambda: maxdev))
+class connected:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        try:
+            is_conn = device.connected
+            _write_json(resp, PropertyResponse(is_conn, req).json_bytes)
+            logger.debug("GET /connected response: %s", resp.data)
+        except Exception as ex:
+            _write_json(resp, _err_json('Switch.Connected failed', ex, req))
+            logger.error("GET /connected error response: %s", resp.data)
+
+    def on_put(self, req: Request, resp: Response, devnum: int):
+        conn_str = _field('Connected', req)
+        # Dict fast path over the only two spellings Alpaca allows for
+        # Connected; a miss goes through to_bool(), which raises the 400
+        # a bad boolean must produce rather than silently transitioning.
+        conn = _ALPACA_BOOL.get(conn_str.strip().lower())
+        if conn is None:
+            conn = to_bool(conn_str)
+        try:
+            # Decide the transition up front; the response is identical
+            # either way, so build it on a single tail path.
+            if conn != device.connected:
+                (device.connect if conn else device.disconnect)()
+            _write_json(resp, _ok_json(req))
+            logger.debug("PUT /connected response: %s", resp.data)
+        except Exception as ex:
+            _write_json(resp, _err_json('Switch.Connected failed', ex, req))
+            logger.error("PUT /connected error response: %s", resp.data)
+
+@before(PreProcessRequest(lambda: maxdev))
+class disconnect:
+    def on_put(self, req: Request, resp: Response, devnum: int):
+        try:
+            device.disconnect()
+            resp.data = _ok_json(req)
+        except Exception as ex:
+            logger.error("disconnect failed: %s", ex)
+            resp.data = _err_json('Switch.Disconnect failed', ex, req)
+
+# Metadata endpoints
+@before(PreProcessRequest(lambda: maxdev))
+class driverinfo:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        resp.data = _const_json(SwitchMetadata.Info, req)
+
+@before(PreProcessRequest(lambda: maxdev))
+class interfaceversion:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        resp.data = _const_json(SwitchMetadata.InterfaceVersion, req)
+
+@before(PreProcessRequest(lambda: maxdev))
+class driverversion:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        resp.data = _const_json(SwitchMetadata.Version, req)
+
+@before(PreProcessRequest(lambda: maxdev))
+class name:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        resp.data = _const_json(SwitchMetadata.Name, req)
+
+@before(PreProcessRequest(lambda: maxdev))
+class supportedactions:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        resp.data = _empty_list_json(req)
+
+@before(PreProcessRequest(lambda: maxdev))
+class maxswitch:
+    def on_get(self, req: Request, resp: Response, devnum: int):
+        if not device.connected:
+            logger.warning("maxswitch: device not connected")
+            resp.data = PropertyResponse(None, req, NotConnectedException()).json_bytes
+            return
+        try:
+            val = device._device_count
+            logger.debug("maxswitch: returning %s", val)
+            resp.data = PropertyResponse(val, req).json_bytes
+        except Exception as ex:
+            logger.error("maxswitch: failed: %s", ex)
+            resp.data = PropertyResponse(None, req, DriverException(0x500, 'Switch.Maxswitch failed', ex)).json_bytes
+
+# CLI for credential management; one subcommand doesn't need argparse
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "credentials":
+        KasaSwitchController().update_credentials()
+        print("Credentials updated.")
+    else:
+        print("Usage: python -m device.switch credentials")
+    sys.exit(0)
+